@@ -21,13 +21,15 @@
 
 import logging
 import os
+import re
 import sys
-import glob
 import subprocess
 import shutil
 import netifaces
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
 import netplan.cli.utils as utils
 from netplan.configmanager import ConfigManager, ConfigurationError
 from netplan.cli.sriov import apply_sriov_config
@@ -38,6 +40,9 @@ OVS_CLEANUP_SERVICE = 'netplan-ovs-cleanup.service'
 
 IF_NAMESIZE = 16
 
+# Characters, which would be interpreted by 'ip -batch' instead of ending up in an interface name
+BATCH_UNSAFE_RE = re.compile(r'[\s#\'"\\]')
+
 
 class NetplanApply(utils.NetplanCommand):
 
@@ -109,15 +114,15 @@ class NetplanApply(utils.NetplanCommand):
                 return
 
         ovs_cleanup_service = '/run/systemd/system/netplan-ovs-cleanup.service'
-        old_files_networkd = bool(glob.glob('/run/systemd/network/*netplan-*'))
-        old_ovs_glob = glob.glob('/run/systemd/system/netplan-ovs-*')
+        old_files_networkd = any(utils.find_netplan_files('/run/systemd/network', anywhere=True))
+        old_ovs_files = list(utils.find_netplan_files('/run/systemd/system', 'netplan-ovs-'))
         # Ignore netplan-ovs-cleanup.service, as it can always be there
-        if ovs_cleanup_service in old_ovs_glob:
-            old_ovs_glob.remove(ovs_cleanup_service)
-        old_files_ovs = bool(old_ovs_glob)
-        old_nm_glob = glob.glob('/run/NetworkManager/system-connections/netplan-*')
-        nm_ifaces = utils.nm_interfaces(old_nm_glob, netifaces.interfaces())
-        old_files_nm = bool(old_nm_glob)
+        if ovs_cleanup_service in old_ovs_files:
+            old_ovs_files.remove(ovs_cleanup_service)
+        old_files_ovs = bool(old_ovs_files)
+        old_nm_files = list(utils.find_netplan_files('/run/NetworkManager/system-connections'))
+        nm_ifaces = utils.nm_interfaces(old_nm_files, netifaces.interfaces())
+        old_files_nm = bool(old_nm_files)
 
         generator_call = []
         generate_out = None
@@ -126,35 +131,38 @@ class NetplanApply(utils.NetplanCommand):
             generate_out = subprocess.STDOUT
 
         generator_call.append(utils.get_generator_path())
-        if run_generate and subprocess.call(generator_call, stderr=generate_out) != 0:
+        # The snapshot of old files above needs to be complete before the
+        # generator starts (re-)writing them, but listing the current
+        # interfaces does not depend on its output, so do that meanwhile.
+        generator = subprocess.Popen(generator_call, stderr=generate_out) if run_generate else None
+        devices = netifaces.interfaces()
+        if generator and generator.wait() != 0:
             if exit_on_error:
                 sys.exit(os.EX_CONFIG)
             else:
                 raise ConfigurationError("the configuration could not be generated")
 
-        devices = netifaces.interfaces()
-
         # Re-start service when
         # 1. We have configuration files for it
         # 2. Previously we had config files for it but not anymore
         # Ideally we should compare the content of the *netplan-* files before and
         # after generation to minimize the number of re-starts, but the conditions
         # above works too.
-        restart_networkd = bool(glob.glob('/run/systemd/network/*netplan-*'))
+        restart_networkd = any(utils.find_netplan_files('/run/systemd/network', anywhere=True))
         if not restart_networkd and old_files_networkd:
             restart_networkd = True
-        restart_ovs_glob = glob.glob('/run/systemd/system/netplan-ovs-*')
+        restart_ovs_files = list(utils.find_netplan_files('/run/systemd/system', 'netplan-ovs-'))
         # Ignore netplan-ovs-cleanup.service, as it can always be there
-        if ovs_cleanup_service in restart_ovs_glob:
-            restart_ovs_glob.remove(ovs_cleanup_service)
-        restart_ovs = bool(restart_ovs_glob)
+        if ovs_cleanup_service in restart_ovs_files:
+            restart_ovs_files.remove(ovs_cleanup_service)
+        restart_ovs = bool(restart_ovs_files)
         if not restart_ovs and old_files_ovs:
             # OVS is managed via systemd units
             restart_networkd = True
 
-        restart_nm_glob = glob.glob('/run/NetworkManager/system-connections/netplan-*')
-        nm_ifaces.update(utils.nm_interfaces(restart_nm_glob, devices))
-        restart_nm = bool(restart_nm_glob)
+        restart_nm_files = list(utils.find_netplan_files('/run/NetworkManager/system-connections'))
+        nm_ifaces.update(utils.nm_interfaces(restart_nm_files, devices))
+        restart_nm = bool(restart_nm_files)
         if not restart_nm and old_files_nm:
             restart_nm = True
 
@@ -180,14 +188,11 @@ class NetplanApply(utils.NetplanCommand):
             logging.debug('netplan generated NM configuration changed, restarting NM')
             if utils.nm_running():
                 # restarting NM does not cause new config to be applied, need to shut down devices first
-                for device in devices:
-                    if device not in nm_ifaces:
-                        continue  # do not touch this interface
-                    # ignore failures here -- some/many devices might not be managed by NM
-                    try:
-                        utils.nmcli(['device', 'disconnect', device])
-                    except subprocess.CalledProcessError:
-                        pass
+                nm_devices = [device for device in devices if device in nm_ifaces]  # do not touch other interfaces
+                if nm_devices:
+                    # the disconnect calls are independent of each other, run them concurrently
+                    with ThreadPoolExecutor(max_workers=min(16, len(nm_devices))) as executor:
+                        list(executor.map(NetplanApply.nm_disconnect_device, nm_devices))
 
                 utils.systemctl_network_manager('stop', sync=sync)
         else:
@@ -215,14 +220,18 @@ class NetplanApply(utils.NetplanCommand):
         # because of the NamePolicy=keep default:
         # https://www.freedesktop.org/software/systemd/man/systemd.net-naming-scheme.html
         devices = netifaces.interfaces()
-        for device in devices:
-            logging.debug('netplan triggering .link rules for %s', device)
+        linked_devices = []
+        if devices:
+            # The net_setup_link builtin calls of different devices are
+            # independent of each other, spawn them concurrently.
+            with ThreadPoolExecutor(max_workers=min(32, len(devices))) as executor:
+                results = executor.map(NetplanApply.trigger_link_rules, devices)
+                linked_devices = [device for device, ok in zip(devices, results) if ok]
+        # 'udevadm test' runs the full rule set, which may rename interfaces.
+        # Keep it sequential, so overlapping or swapped set-name targets are
+        # always resolved in the same device order.
+        for device in linked_devices:
             try:
-                subprocess.check_call(['udevadm', 'test-builtin',
-                                       'net_setup_link',
-                                       '/sys/class/net/' + device],
-                                      stdout=subprocess.DEVNULL,
-                                      stderr=subprocess.DEVNULL)
                 subprocess.check_call(['udevadm', 'test',
                                        '/sys/class/net/' + device],
                                       stdout=subprocess.DEVNULL,
@@ -232,6 +241,7 @@ class NetplanApply(utils.NetplanCommand):
 
         devices_after_udev = netifaces.interfaces()
         # apply some more changes manually
+        renames = []
         for iface, settings in changes.items():
             # rename non-critical network interfaces
             new_name = settings.get('name')
@@ -240,22 +250,17 @@ class NetplanApply(utils.NetplanCommand):
                     logging.warning('Interface name {} is too long. {} will not be renamed'.format(new_name, iface))
                     continue
                 if iface in devices and new_name in devices_after_udev:
-                    logging.debug('Interface rename {} -> {} already happened.'.format(iface, new_name))
+                    logging.debug('Interface rename %s -> %s already happened.', iface, new_name)
                     continue  # re-name already happened via 'udevadm test'
-                # bring down the interface, using its current (matched) interface name
-                subprocess.check_call(['ip', 'link', 'set', 'dev', iface, 'down'],
-                                      stdout=subprocess.DEVNULL,
-                                      stderr=subprocess.DEVNULL)
-                # rename the interface to the name given via 'set-name'
-                subprocess.check_call(['ip', 'link', 'set',
-                                       'dev', iface,
-                                       'name', settings.get('name')],
-                                      stdout=subprocess.DEVNULL,
-                                      stderr=subprocess.DEVNULL)
+                renames.append((iface, new_name))
+        NetplanApply.rename_interfaces(renames)
 
         # Reloading of udev rules happens during 'netplan generate' already
         # subprocess.check_call(['udevadm', 'control', '--reload-rules'])
         subprocess.check_call(['udevadm', 'trigger', '--attr-match=subsystem=net'])
+        # Do not skip this if no renames happened above: 'udevadm trigger' emits
+        # change events for all net devices, which need to be processed before
+        # the backends are (re-)started.
         subprocess.check_call(['udevadm', 'settle'])
 
         # apply any SR-IOV related changes, if applicable
@@ -266,10 +271,11 @@ class NetplanApply(utils.NetplanCommand):
             utils.systemctl('start', ['netplan-regdom.service'])
         # (re)start backends
         if restart_networkd:
-            netplan_wpa = [os.path.basename(f) for f in glob.glob('/run/systemd/system/*.wants/netplan-wpa-*.service')]
+            netplan_units = utils.find_wanted_units('netplan-')
+            netplan_wpa = [u for u in netplan_units if u.startswith('netplan-wpa-')]
             # exclude the special 'netplan-ovs-cleanup.service' unit
-            netplan_ovs = [os.path.basename(f) for f in glob.glob('/run/systemd/system/*.wants/netplan-ovs-*.service')
-                           if not f.endswith('/' + OVS_CLEANUP_SERVICE)]
+            netplan_ovs = [u for u in netplan_units
+                           if u.startswith('netplan-ovs-') and u != OVS_CLEANUP_SERVICE]
             # Run 'systemctl start' command synchronously, to avoid race conditions
             # with 'oneshot' systemd service units, e.g. netplan-ovs-*.service.
             try:
@@ -286,7 +292,7 @@ class NetplanApply(utils.NetplanCommand):
         if restart_nm:
             # Flush all IP addresses of NM managed interfaces, to avoid NM creating
             # new, non netplan-* connection profiles, using the existing IPs.
-            for iface in utils.nm_interfaces(restart_nm_glob, devices):
+            for iface in utils.nm_interfaces(restart_nm_files, devices):
                 utils.ip_addr_flush(iface)
             # clear NM state, especially the [device].managed=true config, as that might have been
             # re-set via an udev rule setting "NM_UNMANAGED=1"
@@ -326,6 +332,64 @@ class NetplanApply(utils.NetplanCommand):
 
         return False
 
+    @staticmethod
+    def nm_disconnect_device(device):  # pragma: nocover (covered in autopkgtest)
+        # ignore failures here -- some/many devices might not be managed by NM
+        try:
+            utils.nmcli(['device', 'disconnect', device])
+        except subprocess.CalledProcessError:
+            pass
+
+    @staticmethod
+    def trigger_link_rules(device):  # pragma: nocover (covered in autopkgtest)
+        """
+        Apply the .link file settings of a device via the net_setup_link
+        builtin. Returns False if the device has no syspath.
+        """
+        logging.debug('netplan triggering .link rules for %s', device)
+        try:
+            subprocess.check_call(['udevadm', 'test-builtin',
+                                   'net_setup_link',
+                                   '/sys/class/net/' + device],
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            logging.debug('Ignoring device without syspath: %s', device)
+            return False
+        return True
+
+    @staticmethod
+    def rename_interfaces(renames):
+        """
+        Bring down and rename the given (current name, new name) interfaces,
+        in order. All commands are fed into a single 'ip -batch' run, unless
+        any name contains characters that 'ip -batch' would interpret itself
+        (e.g. '#' starts a comment, quotes are stripped), in which case each
+        command is run on its own, passing the names as separate arguments.
+        """
+        if not renames:
+            return
+
+        if any(BATCH_UNSAFE_RE.search(name) for rename in renames for name in rename):
+            for iface, new_name in renames:
+                # bring down the interface, using its current (matched) interface name
+                subprocess.check_call(['ip', 'link', 'set', 'dev', iface, 'down'],
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+                # rename the interface to the name given via 'set-name'
+                subprocess.check_call(['ip', 'link', 'set',
+                                       'dev', iface,
+                                       'name', new_name],
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+            return
+
+        batch = ''.join('link set dev {0} down\nlink set dev {0} name {1}\n'.format(iface, new_name)
+                        for iface, new_name in renames)
+        # 'ip -batch' stops at the first failing command and exits non-zero
+        subprocess.run(['ip', '-batch', '-'], input=batch, text=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
     @staticmethod
     def clear_virtual_links(prev_links, curr_links, devices=[]):
         """
@@ -360,29 +424,38 @@ class NetplanApply(utils.NetplanCommand):
         """
 
         changes = {}
+        # Physical interfaces which need a rename, i.e. a new name is set and
+        # a match for the current name is given
+        rename_rules = []
+        for netdef in config_manager.physical_interfaces.values():
+            newname = netdef.set_name
+            if newname and netdef.has_match:
+                rename_rules.append((netdef, newname))
+        # Short-circuit the common case of no renames being requested at all,
+        # as there is no need to query netlink and sysfs for interface data then
+        if not rename_rules:
+            return changes
+
+        link_info = utils.get_interfaces_link_info(interfaces)
+        drivers = utils.get_interfaces_driver_name(interfaces)
         composite_interfaces = [config_manager.bridges, config_manager.bonds]
 
         # Find physical interfaces which need a rename
         # But do not rename virtual interfaces
-        for netdef in config_manager.physical_interfaces.values():
-            newname = netdef.set_name
-            if not newname:
-                continue  # Skip if no new name needs to be set
-            if not netdef.has_match:
-                continue  # Skip if no match for current name is given
+        for netdef, newname in rename_rules:
             if NetplanApply.is_composite_member(composite_interfaces, netdef.id):
-                logging.debug('Skipping composite member {}'.format(netdef.id))
+                logging.debug('Skipping composite member %s', netdef.id)
                 # do not rename members of virtual devices. MAC addresses
                 # may be the same for all interface members.
                 continue
             # Find current name of the interface, according to match conditions and globs (name, mac, driver)
-            current_iface_name = utils.find_matching_iface(interfaces, netdef)
+            current_iface_name = utils.find_matching_iface(interfaces, netdef, link_info, drivers)
             if not current_iface_name:
                 logging.warning('Cannot find unique matching interface for {}'.format(netdef.id))
                 continue
             if current_iface_name == newname:
                 # Skip interface if it already has the correct name
-                logging.debug('Skipping correctly named interface: {}'.format(newname))
+                logging.debug('Skipping correctly named interface: %s', newname)
                 continue
             if netdef.critical:
                 # Skip interfaces defined as critical, as we should not take them down in order to rename
@@ -393,7 +466,7 @@ class NetplanApply(utils.NetplanCommand):
             # record the interface rename change
             changes[current_iface_name] = {'name': newname}
 
-        logging.debug('Link changes: {}'.format(changes))
+        logging.debug('Link changes: %s', changes)
         return changes
 
     @staticmethod
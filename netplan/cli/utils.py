@@ -39,6 +39,41 @@ def get_generator_path():
     return os.environ.get('NETPLAN_GENERATE_PATH', '/usr/libexec/netplan/generate')
 
 
+def find_netplan_files(directory, prefix='netplan-', anywhere=False):
+    '''Yield the paths of netplan generated files inside a directory
+
+    Files match if their name starts with the given prefix, or contains it
+    anywhere, if requested. This is a cheaper alternative to glob.glob(), as it
+    does a single scandir() and avoids compiling fnmatch patterns.'''
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if (prefix in entry.name) if anywhere else entry.name.startswith(prefix):
+                    yield entry.path
+    except FileNotFoundError:
+        return
+
+
+def find_wanted_units(prefix, suffix='.service', unitdir='/run/systemd/system'):
+    '''List the names of units with the given prefix and suffix, which are
+    pulled in via any of unitdir's *.wants/ directories'''
+    try:
+        with os.scandir(unitdir) as it:
+            wants_dirs = [entry.path for entry in it if entry.name.endswith('.wants')]
+    except FileNotFoundError:
+        return []
+
+    units = []
+    for wants_dir in wants_dirs:
+        try:
+            with os.scandir(wants_dir) as it:
+                units.extend(entry.name for entry in it
+                             if entry.name.startswith(prefix) and entry.name.endswith(suffix))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return units
+
+
 def is_nm_snap_enabled():
     return subprocess.call(['systemctl', '--quiet', 'is-enabled', NM_SNAP_SERVICE_NAME], stderr=subprocess.DEVNULL) == 0
 
@@ -146,10 +181,10 @@ def ip_addr_flush(iface):
 
 
 def get_interface_driver_name(interface, only_down=False):  # pragma: nocover (covered in autopkgtest)
-    devdir = os.path.join('/sys/class/net', interface)
+    devdir = '/sys/class/net/' + interface
     if only_down:
         try:
-            with open(os.path.join(devdir, 'operstate')) as f:
+            with open(devdir + '/operstate') as f:
                 state = f.read().strip()
                 if state != 'down':
                     logging.debug('device %s operstate is %s, not changing', interface, state)
@@ -158,30 +193,71 @@ def get_interface_driver_name(interface, only_down=False):  # pragma: nocover (c
             logging.error('Cannot determine operstate of %s: %s', interface, str(e))
             return None
 
+    return _get_driver_name(interface, devdir)
+
+
+def _get_driver_name(interface, devdir, quiet=False):  # pragma: nocover (covered in autopkgtest)
     try:
-        driver = os.path.realpath(os.path.join(devdir, 'device', 'driver'))
-        driver_name = os.path.basename(driver)
+        # we only need the last component of the driver symlink's target, no
+        # need to resolve the whole path via os.path.realpath()
+        driver_name = os.readlink(devdir + '/device/driver').rpartition('/')[2]
     except IOError as e:
-        logging.debug('Cannot replug %s: cannot read link %s/device: %s', interface, devdir, str(e))
+        if not quiet:
+            logging.debug('Cannot replug %s: cannot read link %s/device: %s', interface, devdir, str(e))
         return None
 
     return driver_name
 
 
+def get_interfaces_driver_name(interfaces):  # pragma: nocover (covered in autopkgtest)
+    '''Snapshot the driver names of all given interfaces, in a single pass over /sys/class/net'''
+    drivers = {}
+    wanted = set(interfaces)
+    try:
+        with os.scandir('/sys/class/net') as it:
+            for entry in it:
+                if entry.name in wanted:
+                    # virtual interfaces (lo, veth, bonds, ...) have no driver link
+                    drivers[entry.name] = _get_driver_name(entry.name, entry.path, quiet=True)
+    except FileNotFoundError as e:
+        logging.debug('Cannot list network interfaces: %s', str(e))
+    return drivers
+
+
 def get_interface_macaddress(interface):
     # return an empty list (and string) if no LL data can be found
     link = netifaces.ifaddresses(interface).get(netifaces.AF_LINK, [{}])[0]
     return link.get('addr', '')
 
 
-def find_matching_iface(interfaces: list, netdef):
+def get_interfaces_link_info(interfaces):
+    '''Snapshot the link layer (AF_LINK) data of all given interfaces at once'''
+    return {itf: netifaces.ifaddresses(itf).get(netifaces.AF_LINK, [{}])[0] for itf in interfaces}
+
+
+def _link_macaddress(interface, link_info=None):
+    if link_info is not None and interface in link_info:
+        return link_info[interface].get('addr', '')
+    return get_interface_macaddress(interface)
+
+
+def _link_driver_name(interface, drivers=None):
+    if drivers is not None and interface in drivers:
+        return drivers[interface]
+    return get_interface_driver_name(interface)
+
+
+def find_matching_iface(interfaces: list, netdef, link_info=None, drivers=None):
     assert isinstance(netdef, np.NetDefinition)
     assert netdef.has_match
 
+    # link_info and drivers can be used to pass snapshots of
+    # get_interfaces_link_info() and get_interfaces_driver_name(), to avoid
+    # querying netlink and sysfs for every interface again and again
     matches = list(filter(lambda itf: netdef.match_interface(
             itf_name=itf,
-            itf_driver=get_interface_driver_name(itf),
-            itf_mac=get_interface_macaddress(itf)), interfaces))
+            itf_driver=_link_driver_name(itf, drivers),
+            itf_mac=_link_macaddress(itf, link_info)), interfaces))
 
     # Return current name of unique matched interface, if available
     if len(matches) != 1:
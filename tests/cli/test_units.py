@@ -55,6 +55,43 @@ class TestCLI(unittest.TestCase):
         res = NetplanApply.is_composite_member([{'renderer': 'networkd', 'br0': {'interfaces': ['eth0']}}], 'eth0')
         self.assertTrue(res)
 
+    @patch('subprocess.check_call')
+    @patch('subprocess.run')
+    def test_rename_interfaces(self, mock_run, mock_call):
+        NetplanApply.rename_interfaces([('eth0', 'lan0'), ('eth1', 'lan1')])
+        mock_call.assert_not_called()
+        mock_run.assert_called_once_with(['ip', '-batch', '-'],
+                                         input='link set dev eth0 down\n'
+                                               'link set dev eth0 name lan0\n'
+                                               'link set dev eth1 down\n'
+                                               'link set dev eth1 name lan1\n',
+                                         text=True, stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.DEVNULL, check=True)
+
+    @patch('subprocess.check_call')
+    @patch('subprocess.run')
+    def test_rename_interfaces_batch_unsafe(self, mock_run, mock_call):
+        for renames in [[('eth0', 'lan0'), ('eth1', 'lan#1')],
+                        [('eth#0', 'lan0')],
+                        [('eth0', 'lan"0')],
+                        [('eth0', 'lan0\nlink del dev eth1')]]:
+            mock_call.reset_mock()
+            NetplanApply.rename_interfaces(renames)
+            mock_run.assert_not_called()
+            iface, new_name = renames[-1]
+            mock_call.assert_any_call(['ip', 'link', 'set', 'dev', iface, 'down'],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            mock_call.assert_called_with(['ip', 'link', 'set', 'dev', iface, 'name', new_name],
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.assertEqual(mock_call.call_count, 2 * len(renames))
+
+    @patch('subprocess.check_call')
+    @patch('subprocess.run')
+    def test_rename_interfaces_empty(self, mock_run, mock_call):
+        NetplanApply.rename_interfaces([])
+        mock_run.assert_not_called()
+        mock_call.assert_not_called()
+
     @patch('subprocess.check_call')
     def test_clear_virtual_links(self, mock):
         # simulate as if 'tun3' would have already been delete another way,
@@ -167,6 +167,54 @@ class TestUtils(unittest.TestCase):
         self.assertTrue('ens4' in ifaces)
         self.assertTrue(len(ifaces) == 4)
 
+    def test_find_netplan_files(self):
+        self._create_nm_keyfile('netplan-test.nmconnection', 'eth0')
+        self._create_nm_keyfile('other-test.nmconnection', 'eth1')
+        self._create_nm_keyfile('10-netplan-test.nmconnection', 'eth2')
+        nmdir = os.path.join(self.workdir.name, 'run/NetworkManager/system-connections')
+        files = list(utils.find_netplan_files(nmdir))
+        self.assertEqual(files, [os.path.join(nmdir, 'netplan-test.nmconnection')])
+
+    def test_find_netplan_files_anywhere(self):
+        self._create_nm_keyfile('netplan-test.nmconnection', 'eth0')
+        self._create_nm_keyfile('other-test.nmconnection', 'eth1')
+        self._create_nm_keyfile('10-netplan-test.nmconnection', 'eth2')
+        nmdir = os.path.join(self.workdir.name, 'run/NetworkManager/system-connections')
+        files = sorted(utils.find_netplan_files(nmdir, anywhere=True))
+        self.assertEqual(files, [os.path.join(nmdir, '10-netplan-test.nmconnection'),
+                                 os.path.join(nmdir, 'netplan-test.nmconnection')])
+
+    def test_find_netplan_files_missing_dir(self):
+        files = list(utils.find_netplan_files(os.path.join(self.workdir.name, 'run/systemd/network')))
+        self.assertEqual(files, [])
+
+    def test_find_wanted_units(self):
+        unitdir = os.path.join(self.workdir.name, 'run/systemd/system')
+        os.makedirs(os.path.join(unitdir, 'multi-user.target.wants'))
+        os.makedirs(os.path.join(unitdir, 'systemd-networkd.service.wants'))
+        for unit in ['multi-user.target.wants/netplan-wpa-wlan0.service',
+                     'multi-user.target.wants/other.service',
+                     'systemd-networkd.service.wants/netplan-ovs-br0.service',
+                     'systemd-networkd.service.wants/netplan-ovs-br0.timer',
+                     'netplan-ovs-unwanted.service']:
+            open(os.path.join(unitdir, unit), 'w').close()
+        units = utils.find_wanted_units('netplan-', unitdir=unitdir)
+        self.assertEqual(sorted(units), ['netplan-ovs-br0.service', 'netplan-wpa-wlan0.service'])
+
+    def test_find_wanted_units_no_wants_dir(self):
+        unitdir = os.path.join(self.workdir.name, 'run/systemd/system')
+        os.makedirs(os.path.join(unitdir, 'multi-user.target.wants'))
+        open(os.path.join(unitdir, 'multi-user.target.wants/netplan-wpa-wlan0.service'), 'w').close()
+        # a regular file and a dangling symlink, which only look like *.wants dirs
+        open(os.path.join(unitdir, 'foo.wants'), 'w').close()
+        os.symlink(os.path.join(unitdir, 'nonexistent'), os.path.join(unitdir, 'bar.wants'))
+        units = utils.find_wanted_units('netplan-', unitdir=unitdir)
+        self.assertEqual(units, ['netplan-wpa-wlan0.service'])
+
+    def test_find_wanted_units_missing_dir(self):
+        unitdir = os.path.join(self.workdir.name, 'run/systemd/system')
+        self.assertEqual(utils.find_wanted_units('netplan-', unitdir=unitdir), [])
+
     # For the matching tests, we mock out the functions querying extra data
     @patch('netplan.cli.utils.get_interface_driver_name')
     @patch('netplan.cli.utils.get_interface_macaddress')
@@ -233,6 +281,47 @@ class TestUtils(unittest.TestCase):
         iface = utils.find_matching_iface(DEVICES, state['netplan-id'])
         self.assertEqual(iface, 'ens4')
 
+    @patch('netplan.cli.utils.get_interface_driver_name')
+    @patch('netplan.cli.utils.get_interface_macaddress')
+    def test_find_matching_iface_link_info(self, gim, gidn):
+        gidn.side_effect = lambda x: 'foo' if x == 'ens4' else 'bar'
+        link_info = {itf: {'addr': '00:01:02:03:04:05' if itf == 'eth1' else '00:00:00:00:00:00'}
+                     for itf in DEVICES}
+
+        state = self.load_conf('''network:
+  ethernets:
+    netplan-id:
+      match:
+        name: "e*"
+        macaddress: "00:01:02:03:04:05"''')
+
+        iface = utils.find_matching_iface(DEVICES, state['netplan-id'], link_info)
+        self.assertEqual(iface, 'eth1')
+        gim.assert_not_called()
+
+    @patch('netplan.cli.utils.get_interface_driver_name')
+    @patch('netplan.cli.utils.get_interface_macaddress')
+    def test_find_matching_iface_drivers(self, gim, gidn):
+        gim.side_effect = lambda x: '00:01:02:03:04:05'
+        drivers = {itf: 'foo' if itf == 'ens4' else 'bar' for itf in DEVICES}
+
+        state = self.load_conf('''network:
+  ethernets:
+    netplan-id:
+      match:
+        name: "ens?"
+        driver: "f*"''')
+
+        iface = utils.find_matching_iface(DEVICES, state['netplan-id'], drivers=drivers)
+        self.assertEqual(iface, 'ens4')
+        gidn.assert_not_called()
+
+    @patch('netifaces.ifaddresses')
+    def test_interfaces_link_info(self, ifaddr):
+        ifaddr.side_effect = lambda x: {netifaces.AF_LINK: [{'addr': '00:01:02:03:04:05'}]} if x == 'eth0' else {}
+        self.assertEqual(utils.get_interfaces_link_info(['eth0', 'eth1']),
+                         {'eth0': {'addr': '00:01:02:03:04:05'}, 'eth1': {}})
+
     @patch('netifaces.ifaddresses')
     def test_interface_macaddress(self, ifaddr):
         ifaddr.side_effect = lambda _: {netifaces.AF_LINK: [{'addr': '00:01:02:03:04:05'}]}